@@ -8,7 +8,17 @@ load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+# Keep a warm pool for Postgres so request bursts don't pay for new connections;
+# other backends (e.g. SQLite in development) keep SQLAlchemy's defaults
+ENGINE_OPTIONS = {
+    "pool_size": 20,
+    "max_overflow": 40,
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+    "pool_use_lifo": True,
+} if DATABASE_URL and DATABASE_URL.startswith("postgresql") else {}
+
+engine = create_engine(DATABASE_URL, **ENGINE_OPTIONS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -4,14 +4,20 @@ from database import engine, Base
 from models import Iceberg, User  # ensures tables are registered
 from routes import iceberg, auth
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
 import os
 
 load_dotenv()
 
-# Create all tables on startup
-Base.metadata.create_all(bind=engine)
+# Creating tables is opt-in (INIT_DB=1) so workers don't all hit the database
+# on boot; otherwise run migrations or `python seed_demo.py` once
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if os.getenv("INIT_DB") == "1":
+        Base.metadata.create_all(bind=engine)
+    yield
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -5,13 +5,13 @@ class Iceberg(Base):
     __tablename__ = "icebergs"
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, nullable=False)
+    name = Column(String, nullable=False, index=True)
     latitude = Column(Float)
     longitude = Column(Float)
     image_path = Column(String)
     mask_path = Column(String)
     area = Column(Float)  # sq NM
-    status = Column(String)
+    status = Column(String, index=True)
 
     def serialize(self):
         return {
@@ -1,48 +1,159 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, BackgroundTasks, Request
+from fastapi.responses import FileResponse, Response
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from database import get_db
 from models.iceberg import Iceberg
+import os
 import rasterio
+from rasterio.windows import Window
 import numpy as np
-from PIL import Image
 import requests
-import os
+import shutil
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import imagecodecs
+
+# GDAL looks up config options lazily, so these still apply to every read below.
+# Multithreaded decode helps when one read spans several compressed blocks, as
+# the banded mask reads in cached_mask_area do.
+os.environ.setdefault("GDAL_NUM_THREADS", "ALL_CPUS")
+os.environ.setdefault("GDAL_CACHEMAX", "512")
 
 router = APIRouter(tags=["icebergs"])
 
 UPLOAD_FOLDER = "uploads"
 MASK_FOLDER = "masks"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MASK_READ_BYTES = 4 * 1024 * 1024
+# Each worker's reads already decode on all cores, so keep the pool small
+AREA_WORKERS = 4
+DEMO_IMAGE_TIFF = "uploads/A23A_001.tif"
+DEMO_IMAGE_PNG = "uploads/A23A_001.png"
+DEMO_MASK_TIFF = "masks/A23A_001_mask.tif"
+DEMO_MASK_PNG = "masks/A23A_001_mask.png"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(MASK_FOLDER, exist_ok=True)
 
 def calculate_area_from_mask(mask_path):
     if not mask_path.lower().endswith(".tif"):
         raise ValueError("Mask must be a TIFF file for area calculation.")
-    with rasterio.open(mask_path) as src:
+    # Key on mtime and size so a mask rewritten in place is recomputed
+    stat = os.stat(mask_path)
+    return cached_mask_area(mask_path, stat.st_mtime_ns, stat.st_size)
+
+@lru_cache(maxsize=512)
+def cached_mask_area(mask_path, mtime_ns, size):
+    # sharing=False keeps /update-areas worker threads off GDAL's shared-dataset lock
+    with rasterio.open(mask_path, sharing=False) as src:
         transform = src.transform
-        mask_data = src.read(1)
         pixel_width = abs(transform.a)
         pixel_height = abs(transform.e)
         pixel_area_m2 = pixel_width * pixel_height
-        white_pixel_count = np.sum(mask_data > 0)
+        # Count in bands of whole blocks (~4 MiB each) so large masks never sit
+        # in memory whole, without paying a read call per tiny strip
+        block_height = src.block_shapes[0][0]
+        row_bytes = src.width * np.dtype(src.dtypes[0]).itemsize
+        band_rows = max(block_height, MASK_READ_BYTES // row_bytes // block_height * block_height)
+        white_pixel_count = 0
+        for row in range(0, src.height, band_rows):
+            window = Window(0, row, src.width, min(band_rows, src.height - row))
+            white_pixel_count += int(np.count_nonzero(src.read(1, window=window)))
     area_m2 = white_pixel_count * pixel_area_m2
     return area_m2 / 3_429_904
 
-def tiff_to_png(tiff_path, png_path, normalize=True):
-    img = Image.open(tiff_path)
+def fits_lookup_table(dtype):
+    return dtype.kind == "u" and dtype.itemsize <= 2
+
+def normalize_to_uint8(arr):
+    # float32 input is scaled in place, so callers must not reuse it
+    lo, hi = arr.min(), arr.max()
+    if hi <= lo:
+        return np.zeros(arr.shape, dtype=np.uint8)
+    if fits_lookup_table(arr.dtype):
+        # 8/16-bit rasters: map every pixel through a lookup table in one gather pass.
+        # Integer arithmetic keeps the top of the range at exactly 255.
+        lo, hi = int(lo), int(hi)
+        lut = np.zeros(hi + 1, dtype=np.uint8)
+        lut[lo:] = np.arange(hi - lo + 1, dtype=np.int64) * 255 // (hi - lo)
+        return lut[arr]
+    out = np.empty(arr.shape, dtype=np.uint8)
+    if arr.dtype == np.float32:
+        scaled = arr
+        scaled -= lo
+    else:
+        scaled = np.subtract(arr, lo, dtype=np.float32)
+    # Divide before scaling (not multiply by a reciprocal) so hi maps to exactly 255
+    scaled /= np.float32(hi) - np.float32(lo)
+    scaled *= 255
+    np.copyto(out, scaled, casting="unsafe")
+    return out
+
+def tiff_to_png(tiff_path, png_path, normalize=True, is_mask=False):
+    with rasterio.open(tiff_path, sharing=False) as src:
+        dtype = np.dtype(src.dtypes[0])
+        # Colour imagery becomes an RGB preview; everything else uses band 1
+        bands = [1, 2, 3] if src.count >= 3 and not is_mask else 1
+        if normalize and not is_mask and not fits_lookup_table(dtype):
+            # Have GDAL cast to float32 while decoding instead of copying afterwards
+            arr = src.read(bands, out_dtype="float32")
+        else:
+            arr = src.read(bands)
+    if is_mask:
+        write_mask_png(arr, png_path)
+        return
     if normalize:
-        arr = np.array(img).astype("float32")
-        arr = (arr - arr.min()) / (arr.max() - arr.min()) * 255
-        img = Image.fromarray(arr.astype("uint8"))
-    img.save(png_path, format="PNG")
+        # RGB bands share one min/max so colour balance is preserved
+        arr = normalize_to_uint8(arr)
+    if arr.ndim == 3:
+        arr = np.ascontiguousarray(np.moveaxis(arr, 0, -1))
+    write_png(arr, png_path)
+
+def png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+def write_mask_png(mask, png_path):
+    # Masks are binary, so write a 1-bit PNG directly. Every row uses filter
+    # type 0 (None): Pillow would try all five filters per row, which buys
+    # nothing on long runs of identical pixels.
+    height, width = mask.shape
+    scanlines = np.zeros((height, (width + 7) // 8 + 1), dtype=np.uint8)
+    scanlines[:, 1:] = np.packbits(mask > 0, axis=1)
+    with open(png_path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 1, 0, 0, 0, 0)))
+        f.write(png_chunk(b"IDAT", zlib.compress(scanlines.tobytes(), 1)))
+        f.write(png_chunk(b"IEND", b""))
+
+def write_png(arr, png_path):
+    # PNGs are display previews, so favour encode speed over file size
+    data = imagecodecs.png_encode(arr, level=2, strategy=imagecodecs.PNG.STRATEGY.FILTERED)
+    with open(png_path, "wb") as f:
+        f.write(data)
+
+def save_upload(file, path):
+    # Stream to disk in 1 MiB chunks instead of reading the whole upload into memory
+    with open(path, "wb") as out:
+        shutil.copyfileobj(file.file, out, length=UPLOAD_CHUNK_SIZE)
+
+def png_is_stale(tiff_path, png_path):
+    return not os.path.exists(png_path) or os.path.getmtime(png_path) < os.path.getmtime(tiff_path)
+
+def lazy_convert_demo():
+    # Only re-encode the demo previews when their TIFFs have changed
+    if os.path.exists(DEMO_IMAGE_TIFF) and png_is_stale(DEMO_IMAGE_TIFF, DEMO_IMAGE_PNG):
+        tiff_to_png(DEMO_IMAGE_TIFF, DEMO_IMAGE_PNG)
+    if os.path.exists(DEMO_MASK_TIFF) and png_is_stale(DEMO_MASK_TIFF, DEMO_MASK_PNG):
+        tiff_to_png(DEMO_MASK_TIFF, DEMO_MASK_PNG, is_mask=True)
 
 @router.post("/seed-demo")
 def seed_demo(db: Session = Depends(get_db)):
-    tiff_mask = "masks/A23A_001_mask.tif"
-    if not os.path.exists(tiff_mask):
+    if not os.path.exists(DEMO_MASK_TIFF):
         raise HTTPException(status_code=400, detail="Demo mask not found")
-    area_sqnm = float(calculate_area_from_mask(tiff_mask))
+    lazy_convert_demo()
+    area_sqnm = calculate_area_from_mask(DEMO_MASK_TIFF)
     iceberg = db.query(Iceberg).filter_by(name="A23A Demo Iceberg").first()
     if iceberg:
         iceberg.area = area_sqnm
@@ -51,8 +162,8 @@ def seed_demo(db: Session = Depends(get_db)):
         iceberg = Iceberg(
             name="A23A Demo Iceberg",
             latitude=-73.5, longitude=-40.0,
-            image_path="uploads/A23A_001.png",
-            mask_path="masks/A23A_001_mask.png",
+            image_path=DEMO_IMAGE_PNG,
+            mask_path=DEMO_MASK_PNG,
             area=area_sqnm, status="complete"
         )
         db.add(iceberg)
@@ -63,8 +174,7 @@ def seed_demo(db: Session = Depends(get_db)):
 def upload_image(file: UploadFile = File(...), db: Session = Depends(get_db)):
     filename = file.filename
     tiff_path = os.path.join(UPLOAD_FOLDER, filename)
-    with open(tiff_path, "wb") as f:
-        f.write(file.file.read())
+    save_upload(file, tiff_path)
     png_path = os.path.join(UPLOAD_FOLDER, filename.replace(".tif", ".png"))
     tiff_to_png(tiff_path, png_path)
     iceberg = Iceberg(
@@ -76,37 +186,58 @@ def upload_image(file: UploadFile = File(...), db: Session = Depends(get_db)):
     db.refresh(iceberg)
     return iceberg.serialize()
 
+def list_icebergs(db):
+    # Select plain columns so rows are not hydrated into ORM objects
+    stmt = select(
+        Iceberg.id, Iceberg.name, Iceberg.latitude, Iceberg.longitude,
+        Iceberg.image_path, Iceberg.mask_path, Iceberg.area, Iceberg.status
+    )
+    return [dict(row) for row in db.execute(stmt).mappings()]
+
 @router.get("/icebergs")
 def get_icebergs(db: Session = Depends(get_db)):
-    return [i.serialize() for i in db.query(Iceberg).all()]
+    return list_icebergs(db)
 
 @router.get("/refresh-icebergs")
 def refresh_icebergs(db: Session = Depends(get_db)):
-    return [i.serialize() for i in db.query(Iceberg).all()]
+    return list_icebergs(db)
 
 @router.post("/update-areas")
 def update_areas(db: Session = Depends(get_db)):
-    for iceberg in db.query(Iceberg).all():
-        if not iceberg.mask_path.lower().endswith(".tif"):
-            continue
-        iceberg.area = calculate_area_from_mask(iceberg.mask_path)
+    masks = [
+        (iceberg_id, mask_path)
+        for iceberg_id, mask_path in db.execute(select(Iceberg.id, Iceberg.mask_path))
+        if mask_path and mask_path.lower().endswith(".tif")
+    ]
+    # rasterio releases the GIL while decoding, so masks can be read in parallel
+    with ThreadPoolExecutor(max_workers=AREA_WORKERS) as pool:
+        areas = pool.map(calculate_area_from_mask, [mask_path for _, mask_path in masks])
+        rows = [{"id": iceberg_id, "area": area} for (iceberg_id, _), area in zip(masks, areas)]
+    if rows:
+        db.bulk_update_mappings(Iceberg, rows)
     db.commit()
     return {"status": "success"}
 
+def safe_post(url, payload):
+    try:
+        requests.post(url, json=payload, timeout=5)
+    except Exception:
+        pass
+
 @router.post("/upload-mask")
 def upload_mask(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: Session = Depends(get_db)
 ):
     filename = file.filename
     mask_tiff_path = os.path.join(MASK_FOLDER, filename)
-    with open(mask_tiff_path, "wb") as f:
-        f.write(file.file.read())
+    save_upload(file, mask_tiff_path)
     if not mask_tiff_path.lower().endswith(".tif"):
         raise HTTPException(status_code=400, detail="Mask must be a TIFF file")
     mask_png_path = mask_tiff_path.replace(".tif", ".png")
-    tiff_to_png(mask_tiff_path, mask_png_path)
-    area_sqnm = float(calculate_area_from_mask(mask_tiff_path))
+    tiff_to_png(mask_tiff_path, mask_png_path, is_mask=True)
+    area_sqnm = calculate_area_from_mask(mask_tiff_path)
     inferred = filename.replace("_mask.tif", "").replace(".tif", "")
     iceberg = db.query(Iceberg).filter_by(name=inferred).first()
     if iceberg:
@@ -126,16 +257,29 @@ def upload_mask(
     response["notification"] = "Mask has been generated and saved!"
     notify_url = os.getenv("FRONTEND_NOTIFY_URL")
     if notify_url:
-        try:
-            requests.post(notify_url, json=response, timeout=5)
-        except Exception:
-            pass
+        # Run after the response is sent so the caller doesn't wait on the webhook
+        background_tasks.add_task(safe_post, notify_url, response)
+    return response
+
+# Previews are rewritten under the same name and loaded from unversioned URLs,
+# so browsers must revalidate every time; unchanged files come back as a cheap 304
+PREVIEW_CACHE_HEADERS = {"Cache-Control": "no-cache"}
+
+def preview_response(request, path):
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="File not found")
+    response = FileResponse(path, headers=PREVIEW_CACHE_HEADERS, stat_result=os.stat(path))
+    # FileResponse sends an ETag but never checks it, so answer revalidations here
+    etag = response.headers["etag"]
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag, **PREVIEW_CACHE_HEADERS})
     return response
 
 @router.get("/uploads/{filename}")
-def serve_uploads(filename: str):
-    return FileResponse(os.path.join(UPLOAD_FOLDER, filename))
+def serve_uploads(filename: str, request: Request):
+    return preview_response(request, os.path.join(UPLOAD_FOLDER, filename))
 
 @router.get("/masks/{filename}")
-def serve_masks(filename: str):
-    return FileResponse(os.path.join(MASK_FOLDER, filename))
\ No newline at end of file
+def serve_masks(filename: str, request: Request):
+    return preview_response(request, os.path.join(MASK_FOLDER, filename))
\ No newline at end of file